@@ -1,24 +1,43 @@
 # app.py - Versão Segura com Rate Limiting e Validações
 import os
-from flask import Flask, request, render_template, send_file, jsonify, url_for
+import time
+from flask import Flask, Response, request, render_template, jsonify, url_for, stream_with_context
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from tasks import run_extraction_task, celery_app
-from celery.result import AsyncResult
-from io import BytesIO
+from tasks import (
+    run_extraction_task, celery_app, get_compact_states,
+    markdown_size, iter_markdown, follow_markdown, check_admission, get_job_record,
+    get_redis_client, MarkdownStreamError, RATELIMIT_STORAGE_URL, ADMISSION_RETRY_AFTER
+)
 
 app = Flask(__name__)
 
 # Configuração de segurança
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limita upload a 16MB
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() != 'false'
+
+# Tamanho dos blocos enviados no download em streaming
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Intervalo (segundos) entre leituras do Redis no download em andamento
+STREAM_POLL_INTERVAL = 1.0
+
+# Espera máxima (segundos) por uma tarefa ainda PENDING e sem arquivo antes de
+# responder 404 no streaming (IDs desconhecidos nunca saem de PENDING)
+STREAM_PENDING_GRACE = 15
 
-# Rate Limiting
+# Máximo de tarefas por consulta de status em lote
+MAX_BATCH_STATUS = 100
+
+# Rate Limiting. Usa o pool compartilhado da sua URL: se RATELIMIT_STORAGE_URL
+# for a mesma do backend de resultados, é o mesmo pool das consultas de status
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri=os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    storage_uri=RATELIMIT_STORAGE_URL,
+    storage_options={'connection_pool': get_redis_client(RATELIMIT_STORAGE_URL).connection_pool}
 )
 
 # Headers de segurança
@@ -55,81 +74,214 @@ def start_extraction():
     if len(chat_url) > 2048:
         return jsonify({"error": "URL muito longa."}), 400
 
+    client = get_remote_address()
+    
+    # Admissão por custo: evita iniciar jobs que devem estourar o tempo limite
     try:
-        task = run_extraction_task.delay(chat_url)
+        decision, prediction = check_admission(chat_url, client)
+    except Exception as e:
+        app.logger.warning(f"Admissão indisponível, aceitando tarefa: {str(e)}")
+        decision, prediction = 'admit', None
+    
+    if decision == 'reject':
+        return jsonify({
+            "error": "Esta conversa deve exceder o tempo máximo de processamento.",
+            "predicted_seconds": prediction['predicted_seconds']
+        }), 422
+    
+    if decision == 'defer':
+        response = jsonify({
+            "error": "Extrações recentes estão próximas do tempo limite. Tente novamente em alguns minutos.",
+            "predicted_seconds": prediction['predicted_seconds']
+        })
+        response.headers['Retry-After'] = str(ADMISSION_RETRY_AFTER)
+        return response, 503
+
+    try:
+        task = run_extraction_task.delay(chat_url, client=client)
         
         return jsonify({
             "task_id": task.id,
-            "status_url": url_for('get_task_status', task_id=task.id)
+            "status_url": url_for('get_task_status', task_id=task.id),
+            "stream_url": url_for('stream_file', task_id=task.id)
         }), 202
     except Exception as e:
         app.logger.error(f"Erro ao iniciar tarefa: {str(e)}")
         return jsonify({"error": "Erro ao processar requisição."}), 500
 
+def is_valid_task_id(task_id):
+    """Validação simples do task_id (deve ser UUID)"""
+    return isinstance(task_id, str) and 0 < len(task_id) <= 100
+
+def build_status_response(task_id, compact):
+    """Monta a resposta de status a partir do registro compacto da tarefa"""
+    state = compact['state']
+    response = {'state': state}
+    
+    if state == 'PENDING':
+        response['status'] = 'Pendente...'
+    elif state == 'SUCCESS':
+        response['status'] = 'Concluído!'
+        response['download_url'] = url_for('download_file', task_id=task_id)
+    elif state == 'FAILURE':
+        response['status'] = compact.get('error', 'Erro desconhecido.')
+    else:
+        response['status'] = 'Processando...'
+        if 'progress' in compact:
+            response['progress'] = compact['progress']
+            if compact['progress'].get('turns'):
+                response['status'] = f"Processando... ({compact['progress']['turns']} turnos)"
+    return response
+
 # Rota API: Verifica o status de uma tarefa
 @app.route('/api/status/<task_id>')
 @limiter.limit("30 per minute")  # Permite polling frequente
 def get_task_status(task_id):
-    # Validação simples do task_id (deve ser UUID)
-    if not task_id or len(task_id) > 100:
+    if not is_valid_task_id(task_id):
         return jsonify({"error": "Task ID inválido."}), 400
     
     try:
-        task = AsyncResult(task_id, app=celery_app)
-        
-        if task.state == 'PENDING':
-            response = {'state': task.state, 'status': 'Pendente...'}
-        elif task.state != 'FAILURE':
-            response = {'state': task.state, 'status': 'Processando...'}
-            if task.state == 'SUCCESS':
-                response['status'] = 'Concluído!'
-                response['download_url'] = url_for('download_file', task_id=task.id)
-        else:
-            response = {
-                'state': task.state,
-                'status': str(task.info)
-            }
-        return jsonify(response)
+        compact = get_compact_states([task_id])[task_id]
+        return jsonify(build_status_response(task_id, compact))
     except Exception as e:
         app.logger.error(f"Erro ao verificar status: {str(e)}")
         return jsonify({"error": "Erro ao verificar status."}), 500
 
+# Rota API: Verifica o status de várias tarefas em uma única requisição
+@app.route('/api/status', methods=['POST'])
+@limiter.limit("30 per minute")  # Uma consulta em lote conta como uma única requisição
+def get_batch_status():
+    try:
+        data = request.get_json()
+        task_ids = data.get('task_ids') if isinstance(data, dict) else None
+    except Exception:
+        return jsonify({"error": "Corpo da requisição inválido."}), 400
+    
+    if not isinstance(task_ids, list) or not task_ids:
+        return jsonify({"error": "Lista de task_ids não fornecida."}), 400
+    
+    if len(task_ids) > MAX_BATCH_STATUS:
+        return jsonify({"error": f"Máximo de {MAX_BATCH_STATUS} tarefas por consulta."}), 400
+    
+    if not all(is_valid_task_id(task_id) for task_id in task_ids):
+        return jsonify({"error": "Task ID inválido."}), 400
+    
+    try:
+        # Remove duplicados preservando a ordem
+        unique_ids = list(dict.fromkeys(task_ids))
+        states = get_compact_states(unique_ids)
+        return jsonify({
+            "tasks": {
+                task_id: build_status_response(task_id, states[task_id])
+                for task_id in unique_ids
+            }
+        })
+    except Exception as e:
+        app.logger.error(f"Erro ao verificar status em lote: {str(e)}")
+        return jsonify({"error": "Erro ao verificar status."}), 500
+
 # Rota API: Faz o download do arquivo quando a tarefa está pronta
 @app.route('/api/download/<task_id>')
 @limiter.limit("10 per minute")  # Limita downloads
 def download_file(task_id):
-    # Validação do task_id
-    if not task_id or len(task_id) > 100:
+    if not is_valid_task_id(task_id):
         return jsonify({"error": "Task ID inválido."}), 400
     
     try:
-        task = AsyncResult(task_id, app=celery_app)
+        state = get_compact_states([task_id])[task_id]['state']
         
-        if not task.ready():
+        if state == 'FAILURE':
+            return jsonify({"error": "A tarefa falhou."}), 404
+        
+        if state != 'SUCCESS':
             return jsonify({"error": "O arquivo ainda não está pronto."}), 425
         
-        if task.failed():
+        size = markdown_size(task_id)
+        
+        if not size:
+            return jsonify({"error": "O arquivo expirou. Inicie uma nova extração."}), 404
+        
+        # Envia direto do Redis em blocos, sem carregar o arquivo inteiro
+        return Response(
+            stream_with_context(iter_markdown(task_id, DOWNLOAD_CHUNK_SIZE)),
+            mimetype='text/markdown',
+            headers={
+                'Content-Disposition': 'attachment; filename=conversa_arquivada.md',
+                'Content-Length': str(size)
+            }
+        )
+    except Exception as e:
+        app.logger.error(f"Erro no download: {str(e)}")
+        return jsonify({"error": "Erro ao processar download."}), 500
+
+# Rota API: Download em streaming enquanto a extração ainda está em andamento
+@app.route('/api/stream/<task_id>')
+@limiter.limit("10 per minute")  # Mesmo limite do download
+def stream_file(task_id):
+    if not is_valid_task_id(task_id):
+        return jsonify({"error": "Task ID inválido."}), 400
+    
+    try:
+        state = get_compact_states([task_id])[task_id]['state']
+        
+        if state == 'FAILURE':
             return jsonify({"error": "A tarefa falhou."}), 404
-            
-        markdown_content = task.result
         
-        if not markdown_content or not isinstance(markdown_content, str):
-            return jsonify({"error": "Conteúdo inválido."}), 500
+        if state == 'SUCCESS' and not markdown_size(task_id):
+            return jsonify({"error": "O arquivo expirou. Inicie uma nova extração."}), 404
+        
+        grace_deadline = time.monotonic() + STREAM_PENDING_GRACE
+        while state == 'PENDING' and not markdown_size(task_id):
+            if time.monotonic() > grace_deadline:
+                return jsonify({"error": "Tarefa não encontrada ou ainda na fila. Tente novamente em instantes."}), 404
+            time.sleep(STREAM_POLL_INTERVAL)
+            state = get_compact_states([task_id])[task_id]['state']
+        
+        timeout = celery_app.conf.task_time_limit + 60
         
-        buffer = BytesIO()
-        buffer.write(markdown_content.encode('utf-8'))
-        buffer.seek(0)
+        def generate():
+            try:
+                yield from follow_markdown(task_id, DOWNLOAD_CHUNK_SIZE, STREAM_POLL_INTERVAL, timeout)
+            except MarkdownStreamError as e:
+                # Propagar a exceção faz o servidor fechar a conexão sem o bloco
+                # final do chunked encoding: o cliente vê um download incompleto
+                # em vez de um arquivo truncado com aparência de completo
+                app.logger.warning(f"Streaming interrompido ({task_id}): {str(e)}")
+                raise
         
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name='conversa_arquivada.md',
-            mimetype='text/markdown'
+        # Sem Content-Length: a resposta usa chunked transfer encoding e cada
+        # turno é enviado assim que o worker o grava. Encerra quando a tarefa termina
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/markdown',
+            headers={
+                'Content-Disposition': 'attachment; filename=conversa_arquivada.md',
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # Desativa buffering em proxies Nginx
+            }
         )
     except Exception as e:
-        app.logger.error(f"Erro no download: {str(e)}")
+        app.logger.error(f"Erro no streaming: {str(e)}")
         return jsonify({"error": "Erro ao processar download."}), 500
 
+# Rota API: Custo medido de um job (tempo por fase, CPU, RAM, bytes, turnos)
+@app.route('/api/jobs/<task_id>')
+@limiter.limit("30 per minute")
+def get_job_metrics(task_id):
+    if not is_valid_task_id(task_id):
+        return jsonify({"error": "Task ID inválido."}), 400
+    
+    try:
+        record = get_job_record(task_id)
+        if not record:
+            return jsonify({"error": "Métricas não encontradas."}), 404
+        # Não expõe o IP do cliente
+        record.pop('client', None)
+        return jsonify(record)
+    except Exception as e:
+        app.logger.error(f"Erro ao buscar métricas: {str(e)}")
+        return jsonify({"error": "Erro ao buscar métricas."}), 500
+
 # Health check endpoint
 @app.route('/health')
 def health():
@@ -146,6 +298,7 @@ if __name__ == '__main__':
     flask_env = os.getenv('FLASK_ENV', 'production')
     is_debug = flask_env == 'development'
     
+    # Servidor de desenvolvimento (Werkzeug). Em produção use: gunicorn -c gunicorn.conf.py wsgi:app
     print(f"Servidor Flask iniciando em modo: {flask_env}")
     print(f"Debug: {is_debug}")
     print("Acesse http://127.0.0.1:5000/")
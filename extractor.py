@@ -1,9 +1,17 @@
 # extractor.py - Versão Corrigida com Segurança Melhorada
 
 import sys
+import time
+import uuid
+import threading
 from urllib.parse import urlparse
 from playwright.sync_api import sync_playwright
 
+try:
+    import psutil
+except ImportError:  # Métricas de CPU/RAM do navegador ficam indisponíveis
+    psutil = None
+
 # --- CONFIGURAÇÕES DE EXTRAÇÃO ---
 TARGET_PLATFORM_URL = "chatgpt.com"
 TARGET_PLATFORM_NAME = "ChatGPT" 
@@ -15,6 +23,12 @@ NAV_TIMEOUT = 90000  # 90 segundos para navegação inicial
 STABLE_WAIT = 90000  # 90 segundos para a interface carregar
 MESSAGE_WAIT = 90000 # 90 segundos para as mensagens aparecerem
 
+# --- PROGRESSO ---
+PROGRESS_EVERY_TURNS = 25  # Notifica o progresso a cada 25 turnos coletados
+
+# --- MÉTRICAS ---
+RESOURCE_SAMPLE_INTERVAL = 0.5  # Segundos entre amostras de CPU/RAM do navegador
+
 # --- Função para validar URL ---
 def validate_url(url: str) -> tuple[bool, str]:
     """
@@ -49,28 +63,148 @@ def block_unnecessary_requests(route):
     else:
         route.continue_()
 
+class BrowserResourceSampler:
+    """
+    Mede o tempo de CPU e o pico de RAM (RSS) da árvore de processos do
+    Chromium e grava os valores em `stats` (browser_cpu_seconds,
+    browser_peak_rss_bytes). Requer psutil.
+    
+    Cada instância gera um marcador único (`launch_arg`) que deve ser passado
+    em chromium.launch(args=...): start() localiza o processo do navegador
+    pelo marcador na linha de comando, de modo que extrações simultâneas no
+    mesmo worker não se confundem. A amostragem termina sozinha quando esses
+    processos são encerrados.
+    """
+    def __init__(self, stats, interval=RESOURCE_SAMPLE_INTERVAL):
+        self.stats = stats
+        self.interval = interval
+        self.launch_arg = f'--growchats-job={uuid.uuid4().hex}'
+        self._cpu_by_pid = {}
+        self._roots = []
+        self._lock = threading.Lock()
+        self.stats.update({'browser_cpu_seconds': None, 'browser_peak_rss_bytes': None})
+
+    def _find_roots(self):
+        """Processos descendentes cuja linha de comando contém o marcador."""
+        marked = []
+        try:
+            descendants = psutil.Process().children(recursive=True)
+        except psutil.Error:
+            return []
+        for proc in descendants:
+            try:
+                if self.launch_arg in proc.cmdline():
+                    marked.append(proc)
+            except psutil.Error:
+                continue
+        # Subprocessos que herdam o marcador já entram via children()
+        marked_pids = {proc.pid for proc in marked}
+        roots = []
+        for proc in marked:
+            try:
+                if proc.ppid() not in marked_pids:
+                    roots.append(proc)
+            except psutil.Error:
+                continue
+        return roots
+
+    def start(self):
+        """Identifica os processos do navegador e inicia a amostragem periódica."""
+        if psutil is None:
+            return
+        self._roots = self._find_roots()
+        self.stats.update({'browser_cpu_seconds': 0.0, 'browser_peak_rss_bytes': 0})
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while self.sample():
+            time.sleep(self.interval)
+
+    def sample(self):
+        """
+        Soma RSS e tempo de CPU de todos os processos da árvore.
+        Retorna False quando não há mais processos vivos.
+        """
+        if not self._roots:
+            return False
+        processes = []
+        for root in self._roots:
+            try:
+                processes.append(root)
+                processes.extend(root.children(recursive=True))
+            except psutil.Error:
+                continue
+        total_rss = 0
+        cpu_by_pid = {}
+        for proc in processes:
+            try:
+                with proc.oneshot():
+                    total_rss += proc.memory_info().rss
+                    cpu = proc.cpu_times()
+                    cpu_by_pid[proc.pid] = cpu.user + cpu.system
+            except psutil.Error:
+                continue
+        with self._lock:
+            # Processos já encerrados mantêm o último tempo de CPU medido
+            for pid, cpu in cpu_by_pid.items():
+                self._cpu_by_pid[pid] = max(cpu, self._cpu_by_pid.get(pid, 0.0))
+            self.stats['browser_cpu_seconds'] = round(sum(self._cpu_by_pid.values()), 2)
+            self.stats['browser_peak_rss_bytes'] = max(self.stats['browser_peak_rss_bytes'], total_rss)
+        return bool(cpu_by_pid)
+
+def format_header() -> str:
+    """Cabeçalho Markdown do arquivo da conversa."""
+    return f"# Conversa Arquivada - {TARGET_PLATFORM_NAME}\n\n---\n\n"
+
+def format_turn(msg: dict) -> str:
+    """
+    Formata um dicionário {emissor: str, conteudo: str} como um turno em Markdown.
+    """
+    content = msg['conteudo'].strip()
+    # Sanitização básica - remover caracteres potencialmente perigosos
+    content = content.replace('\x00', '')  # Remove null bytes
+    formatted_content = content.replace('\n', '\n> ')
+    return f"## {msg['emissor']}:\n> {formatted_content}\n\n"
+
 def format_conversation_data(messages: list) -> str:
     """
     Formata uma lista de dicionários {emissor: str, conteudo: str} para Markdown.
     """
-    markdown_output = f"# Conversa Arquivada - {TARGET_PLATFORM_NAME}\n\n"
-    markdown_output += "---\n\n"
-    
-    for msg in messages:
-        markdown_output += f"## {msg['emissor']}:\n"
-        content = msg['conteudo'].strip()
-        # Sanitização básica - remover caracteres potencialmente perigosos
-        content = content.replace('\x00', '')  # Remove null bytes
-        formatted_content = content.replace('\n', '\n> ')
-        markdown_output += f"> {formatted_content}\n\n"
-        
-    return markdown_output
+    return format_header() + "".join(format_turn(msg) for msg in messages)
 
-def extract_conversation(url: str):
+def extract_conversation(url: str, on_progress=None, on_chunk=None, stats=None):
     """
     Navega, extrai todos os turnos e retorna o conteúdo formatado em Markdown.
     Retorna (markdown_string) ou (error_message, http_status_code).
+    
+    on_progress: callback opcional chamado como on_progress(fase, turnos)
+    a cada etapa da extração.
+    on_chunk: callback opcional chamado com cada trecho do Markdown (cabeçalho
+    e cada turno) assim que é coletado. A concatenação dos trechos é idêntica
+    ao Markdown retornado.
+    stats: dicionário opcional preenchido com as métricas da extração
+    (turns, bytes_transferred, browser_cpu_seconds, browser_peak_rss_bytes).
     """
+    if stats is None:
+        stats = {}
+    stats.update({'turns': 0, 'bytes_transferred': 0})
+    sampler = BrowserResourceSampler(stats)
+
+    def report(phase, turns=0):
+        sampler.sample()
+        if on_progress:
+            on_progress(phase, turns)
+
+    def count_bytes(request):
+        try:
+            sizes = request.sizes()
+            stats['bytes_transferred'] += (
+                sizes['requestHeadersSize'] + sizes['requestBodySize'] +
+                sizes['responseHeadersSize'] + sizes['responseBodySize']
+            )
+        except Exception:
+            pass
+
     # Validar URL antes de processar
     is_valid, error_msg = validate_url(url)
     if not is_valid:
@@ -87,18 +221,23 @@ def extract_conversation(url: str):
                 '--disable-gpu',
                 '--disable-dev-shm-usage',
                 '--blink-settings=imagesEnabled=false',
-                '--disable-web-security'  # Apenas para scraping
+                '--disable-web-security',  # Apenas para scraping
+                sampler.launch_arg  # Identifica os processos desta extração
             ]
         ) 
+        sampler.start()
         page = browser.new_page()
 
         try:
             page.route("**/*", block_unnecessary_requests)
+            page.on("requestfinished", count_bytes)
 
             print("[EXTRACTOR] Navegando...")
+            report("navegando")
             page.goto(url, timeout=NAV_TIMEOUT, wait_until='domcontentloaded')
 
             print("[EXTRACTOR] Aguardando carregamento estável...")
+            report("carregando")
             page.wait_for_selector(STABLE_WAIT_SELECTOR, state="visible", timeout=STABLE_WAIT)
             page.wait_for_load_state("domcontentloaded")
             
@@ -116,6 +255,7 @@ def extract_conversation(url: str):
                 return "Nenhuma mensagem encontrada na conversa.", 404
             
             conversation_data = []
+            report("extraindo", 0)
 
             for element in message_elements:
                 data_turn_attribute = element.get_attribute("data-turn")
@@ -130,15 +270,24 @@ def extract_conversation(url: str):
                          message_text = element.inner_text()
                 
                 if message_text and message_text.strip(): 
-                    conversation_data.append({
+                    msg = {
                         "emissor": emissor,
                         "conteudo": message_text
-                    })
+                    }
+                    if on_chunk:
+                        if not conversation_data:
+                            on_chunk(format_header())
+                        on_chunk(format_turn(msg))
+                    conversation_data.append(msg)
+                    stats['turns'] = len(conversation_data)
+                    if len(conversation_data) % PROGRESS_EVERY_TURNS == 0:
+                        report("extraindo", len(conversation_data))
             
             if not conversation_data:
                 browser.close()
                 return "Não foi possível extrair o conteúdo da conversa.", 500
             
+            report("formatando", len(conversation_data))
             markdown_output = format_conversation_data(conversation_data)
             
             browser.close()
@@ -0,0 +1,26 @@
+# gunicorn.conf.py - Configuração do servidor de produção
+import multiprocessing
+import os
+
+# Endereço de escuta
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Múltiplos processos + workers gevent: cada processo atende várias requisições
+# concorrentes enquanto aguarda o Redis, sem bloquear as demais
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = 'gevent'
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '100'))  # Não exceder REDIS_MAX_CONNECTIONS
+
+# Timeouts
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+# Recicla workers periodicamente (previne memory leaks)
+max_requests = 1000
+max_requests_jitter = 100
+
+# Logs no stdout/stderr (capturados pelo start.py)
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOGLEVEL', 'info')
@@ -3,6 +3,10 @@
 Growchats - Inicializador Completo
 Inicia Docker + Redis + Celery + Flask
 Para tudo junto com Ctrl+C
+
+Uso:
+    python start.py          # Flask em modo desenvolvimento (Werkzeug)
+    python start.py --prod   # Servidor de produção (Gunicorn + gevent)
 """
 import subprocess
 import sys
@@ -122,11 +126,11 @@ def check_redis_container():
         return False
 
 def start_redis():
-    """Inicia o Redis usando docker-compose"""
+    """Inicia o Redis principal e o Redis de resultados usando docker-compose"""
     print_colored("🐳 Iniciando Docker Redis...", Colors.OKBLUE)
     try:
         subprocess.run(
-            ["docker-compose", "up", "-d", "redis"],
+            ["docker-compose", "up", "-d", "redis", "redis-results"],
             check=True,
             timeout=30
         )
@@ -141,6 +145,27 @@ def start_redis():
         print_colored("Instale com: pip install docker-compose", Colors.WARNING)
         return False
 
+def build_app_env():
+    """Ambiente dos processos: resultados no Redis de resultados do docker-compose (porta 6380)"""
+    env = os.environ.copy()
+    env.setdefault("CELERY_RESULT_BACKEND", "redis://localhost:6380/0")
+    return env
+
+def build_web_command(production):
+    """Monta o comando do servidor web (Gunicorn em produção, Werkzeug em desenvolvimento)"""
+    if production:
+        import platform
+        if platform.system() == "Windows":
+            # Gunicorn não roda no Windows
+            print_colored("⚠️  Gunicorn não é suportado no Windows. Usando servidor de desenvolvimento.", Colors.WARNING)
+        else:
+            return [
+                sys.executable, "-m", "gunicorn",
+                "-c", "gunicorn.conf.py",
+                "wsgi:app"
+            ], "Gunicorn"
+    return [sys.executable, "app.py"], "Flask"
+
 def check_venv():
     """Verifica se está rodando no venv"""
     return hasattr(sys, 'real_prefix') or (
@@ -148,6 +173,8 @@ def check_venv():
     )
 
 def main():
+    production = "--prod" in sys.argv[1:]
+    
     print_colored("\n🚀 Growchats - Inicializador Completo", Colors.HEADER)
     print_colored("=" * 50, Colors.HEADER)
     
@@ -176,6 +203,7 @@ def main():
     print_colored("\n📦 Iniciando aplicação...\n", Colors.OKCYAN)
     
     processes = []
+    app_env = build_app_env()
     
     try:
         # 1. Iniciar Celery Worker
@@ -193,21 +221,24 @@ def main():
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             universal_newlines=True,
-            bufsize=1
+            bufsize=1,
+            env=app_env
         )
         processes.append(('Celery', celery_process))
         time.sleep(3)
         
-        # 2. Iniciar Flask
-        print_colored("[2/2] Iniciando Flask Server...", Colors.OKBLUE)
-        flask_process = subprocess.Popen(
-            [sys.executable, "app.py"],
+        # 2. Iniciar servidor web
+        web_cmd, web_name = build_web_command(production)
+        print_colored(f"[2/2] Iniciando {web_name} Server...", Colors.OKBLUE)
+        web_process = subprocess.Popen(
+            web_cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             universal_newlines=True,
-            bufsize=1
+            bufsize=1,
+            env=app_env
         )
-        processes.append(('Flask', flask_process))
+        processes.append((web_name, web_process))
         time.sleep(2)
         
         print_colored("\n" + "=" * 50, Colors.OKGREEN)
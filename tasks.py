@@ -1,8 +1,23 @@
 # tasks.py - Versão com Segurança e Logging Melhorado
 from celery import Celery
+from celery.exceptions import SoftTimeLimitExceeded
 from extractor import extract_conversation
+from urllib.parse import urlparse
 import os
+import re
+import json
+import time
+import hashlib
 import logging
+import statistics
+import contextlib
+import redis
+
+try:
+    import gevent
+    from gevent import monkey as gevent_monkey
+except ImportError:  # Worker sem gevent: o Celery impõe o soft time limit
+    gevent = None
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -11,7 +26,51 @@ logger = logging.getLogger(__name__)
 # Configura o Celery para usar o Redis como broker e backend de resultados
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
-celery_app = Celery('tasks', broker=REDIS_URL, backend=REDIS_URL)
+def redis_url_for_db(url, db):
+    """Retorna a mesma URL do Redis apontando para outro banco lógico"""
+    return urlparse(url)._replace(path=f"/{db}").geturl()
+
+# Fila, resultados, rate limiting e contabilidade de jobs ficam em bancos lógicos
+# separados (0 a 3). Cada um pode apontar para uma instância própria via variável de ambiente
+BROKER_URL = os.getenv("CELERY_BROKER_URL", redis_url_for_db(REDIS_URL, 0))
+RESULT_BACKEND_URL = os.getenv("CELERY_RESULT_BACKEND", redis_url_for_db(REDIS_URL, 1))
+RATELIMIT_STORAGE_URL = os.getenv("RATELIMIT_STORAGE_URL", redis_url_for_db(REDIS_URL, 2))
+JOBS_STORAGE_URL = os.getenv("JOBS_STORAGE_URL", redis_url_for_db(REDIS_URL, 3))
+
+# Tamanho máximo de cada pool de conexões Redis (por processo)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+
+# Tempo de vida (segundos) de resultados e arquivos Markdown gerados
+RESULT_EXPIRES = int(os.getenv("RESULT_EXPIRES", "3600"))
+
+# Prefixo das chaves com o conteúdo Markdown (fora do meta do Celery)
+MARKDOWN_KEY_PREFIX = "growchats-markdown-"
+
+# --- CONTABILIDADE DE JOBS ---
+JOB_KEY_PREFIX = "growchats-job-"  # Registro de custo da última tentativa de cada job
+JOB_HISTORY_KEY = "growchats-jobs"  # Lista com os registros mais recentes
+COST_KEY_PREFIX = "growchats-cost:"  # Tempos recentes por URL, cliente e host
+JOB_RECORD_TTL = int(os.getenv("JOB_RECORD_TTL", str(30 * 24 * 3600)))  # 30 dias
+JOB_HISTORY_LIMIT = 1000
+COST_HISTORY_SIZE = 20
+
+# --- ADMISSÃO POR CUSTO ---
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() != "false"
+# Fração do soft time limit a partir da qual um job é considerado arriscado
+ADMISSION_MAX_RATIO = 0.9
+# Amostras mínimas para confiar na previsão de cada dimensão. No host, cada
+# amostra é a mediana de um cliente diferente de quem pede a extração
+ADMISSION_MIN_SAMPLES = {'url': 2, 'client': 5, 'host': 3}
+# Segundos sugeridos ao cliente (Retry-After) quando o job é adiado
+ADMISSION_RETRY_AFTER = 300
+# Segundos até uma URL recusada (422) poder ser tentada de novo
+ADMISSION_URL_RETRY_AFTER = int(os.getenv("ADMISSION_URL_RETRY_AFTER", "3600"))  # 1 hora
+# Validade do histórico por dimensão. Jobs recusados ou adiados não rodam e não
+# renovam o histórico, que expira e libera uma nova tentativa (a conversa ou a
+# plataforma podem ter ficado mais rápidas)
+COST_HISTORY_TTL = {'url': ADMISSION_URL_RETRY_AFTER, 'client': ADMISSION_RETRY_AFTER, 'host': ADMISSION_RETRY_AFTER}
+
+celery_app = Celery('tasks', broker=BROKER_URL, backend=RESULT_BACKEND_URL)
 
 # Configurações de segurança do Celery
 celery_app.conf.update(
@@ -24,27 +83,338 @@ celery_app.conf.update(
     task_time_limit=300,  # 5 minutos máximo por tarefa
     task_soft_time_limit=270,  # Aviso após 4.5 minutos
     worker_max_tasks_per_child=50,  # Reinicia worker após 50 tarefas (previne memory leaks)
+    result_backend_thread_safe=True,  # Uma única instância do backend (e do pool Redis) por processo
+    redis_max_connections=REDIS_MAX_CONNECTIONS,  # Tamanho máximo do pool compartilhado
+    result_expires=RESULT_EXPIRES,  # TTL explícito em toda chave de resultado
 )
 
+# Pools Redis por URL, compartilhados por todos os usos da mesma URL no processo
+_redis_pools = {}
+
+def get_redis_client(url):
+    """
+    Cliente Redis com pool compartilhado por processo.
+    
+    A URL do backend de resultados reutiliza o pool do próprio Celery (o mesmo
+    das consultas de status); as demais ganham um pool por URL. Conexões do
+    redis-py ficam presas a um banco, por isso bancos diferentes não dividem pool.
+    """
+    if url == RESULT_BACKEND_URL:
+        return celery_app.backend.client
+    if url not in _redis_pools:
+        _redis_pools[url] = redis.ConnectionPool.from_url(url, max_connections=REDIS_MAX_CONNECTIONS)
+    return redis.Redis(connection_pool=_redis_pools[url])
+
+jobs_client = get_redis_client(JOBS_STORAGE_URL)
+
+# Bytes lidos do início de cada resultado nas consultas de status em lote.
+# O Celery grava {"status": ..., "result": ...}: o estado vem sempre primeiro
+STATUS_PREFIX_BYTES = 512
+STATUS_PREFIX_RE = re.compile(rb'\{\s*"status"\s*:\s*"([A-Z_]+)"')
+
+def _describe_error(result):
+    """Extrai a mensagem de uma exceção serializada pelo Celery"""
+    if isinstance(result, dict) and 'exc_message' in result:
+        message = result['exc_message']
+        if isinstance(message, (list, tuple)):
+            return ' '.join(str(part) for part in message)
+        return str(message)
+    return str(result)
+
+def _compact_state(state, result):
+    """Reduz o meta de uma tarefa a um registro pequeno (sem o conteúdo Markdown)"""
+    compact = {'state': state}
+    if state == 'PROGRESS' and isinstance(result, dict):
+        compact['progress'] = {'phase': result.get('phase'), 'turns': result.get('turns', 0)}
+    elif state == 'FAILURE':
+        compact['error'] = _describe_error(result)
+    return compact
+
+def get_compact_states(task_ids):
+    """
+    Consulta o estado de várias tarefas em uma única ida ao Redis.
+    
+    Lê apenas o início de cada chave de resultado (GETRANGE em pipeline), de modo
+    que o conteúdo de tarefas concluídas nunca é transferido. Só metas de tarefas
+    não concluídas maiores que o prefixo são relidos por inteiro (são pequenos).
+    
+    Args:
+        task_ids: Lista de IDs de tarefas
+        
+    Returns:
+        dict: {task_id: {'state': ..., 'progress'|'error': ...}}
+    """
+    backend = celery_app.backend
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    
+    with backend.client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.getrange(key, 0, STATUS_PREFIX_BYTES - 1)
+        prefixes = pipe.execute()
+    
+    states = {}
+    truncated = []
+    for task_id, key, raw in zip(task_ids, keys, prefixes):
+        if not raw:
+            states[task_id] = {'state': 'PENDING'}
+            continue
+        match = STATUS_PREFIX_RE.match(raw)
+        if match and match.group(1) == b'SUCCESS':
+            states[task_id] = {'state': 'SUCCESS'}
+        elif len(raw) < STATUS_PREFIX_BYTES:
+            meta = json.loads(raw)
+            states[task_id] = _compact_state(meta['status'], meta.get('result'))
+        else:
+            truncated.append((task_id, key))
+    
+    if truncated:
+        with backend.client.pipeline(transaction=False) as pipe:
+            for _, key in truncated:
+                pipe.get(key)
+            values = pipe.execute()
+        for (task_id, _), raw in zip(truncated, values):
+            if not raw:
+                states[task_id] = {'state': 'PENDING'}
+                continue
+            meta = json.loads(raw)
+            states[task_id] = _compact_state(meta['status'], meta.get('result'))
+    
+    return states
+
+def _markdown_key(task_id):
+    return f"{MARKDOWN_KEY_PREFIX}{task_id}"
+
+def store_markdown(task_id, content):
+    """
+    Grava o Markdown de uma tarefa em uma chave própria, com TTL.
+    
+    Returns:
+        int: Tamanho gravado em bytes
+    """
+    data = content.encode('utf-8')
+    celery_app.backend.client.set(_markdown_key(task_id), data, ex=RESULT_EXPIRES)
+    return len(data)
+
+def reset_markdown(task_id):
+    """Remove o Markdown (parcial ou completo) de uma tarefa"""
+    celery_app.backend.client.delete(_markdown_key(task_id))
+
+def append_markdown(task_id, text):
+    """Acrescenta um trecho ao Markdown de uma tarefa em andamento, renovando o TTL"""
+    key = _markdown_key(task_id)
+    with celery_app.backend.client.pipeline(transaction=False) as pipe:
+        pipe.append(key, text.encode('utf-8'))
+        pipe.expire(key, RESULT_EXPIRES)
+        pipe.execute()
+
+def markdown_size(task_id):
+    """Tamanho em bytes do Markdown de uma tarefa (0 se inexistente ou expirado)"""
+    return celery_app.backend.client.strlen(_markdown_key(task_id))
+
+def iter_markdown(task_id, chunk_size, start=0):
+    """Lê o Markdown de uma tarefa em blocos (GETRANGE), sem carregá-lo inteiro"""
+    client = celery_app.backend.client
+    key = _markdown_key(task_id)
+    while True:
+        chunk = client.getrange(key, start, start + chunk_size - 1)
+        if not chunk:
+            break
+        yield chunk
+        start += len(chunk)
+
+class MarkdownStreamError(Exception):
+    """O streaming do Markdown não pode ser concluído com o arquivo completo"""
+
+def follow_markdown(task_id, chunk_size, poll_interval=1.0, timeout=None):
+    """
+    Acompanha o Markdown de uma tarefa enquanto ela roda, como um "tail -f".
+    
+    Envia cada trecho assim que o worker o grava e termina normalmente apenas
+    quando a tarefa conclui com sucesso e todo o arquivo foi enviado.
+    
+    Raises:
+        MarkdownStreamError: Se a tarefa falhar, entrar em nova tentativa (o
+        arquivo é recomeçado), o arquivo for descartado ou o timeout (segundos)
+        for atingido. O arquivo enviado até ali está incompleto.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    offset = 0
+    while True:
+        # O estado é lido antes dos dados: se a tarefa já terminou,
+        # todos os trechos já foram gravados e serão enviados abaixo
+        state = get_compact_states([task_id])[task_id]['state']
+        for chunk in iter_markdown(task_id, chunk_size, start=offset):
+            offset += len(chunk)
+            yield chunk
+        if state == 'SUCCESS':
+            if markdown_size(task_id) != offset:
+                raise MarkdownStreamError("Arquivo alterado durante o envio")
+            return
+        if state in ('FAILURE', 'RETRY'):
+            raise MarkdownStreamError(f"Tarefa terminou com estado {state}")
+        if markdown_size(task_id) < offset:
+            raise MarkdownStreamError("Arquivo parcial descartado pelo worker")
+        if deadline and time.monotonic() > deadline:
+            raise MarkdownStreamError("Tempo limite do streaming excedido")
+        time.sleep(poll_interval)
+
+def _cost_keys(url, client=None):
+    """Chaves do histórico de custo, da dimensão mais específica para a mais geral"""
+    keys = [('url', f"{COST_KEY_PREFIX}url:{hashlib.sha1(url.encode('utf-8')).hexdigest()}")]
+    if client:
+        keys.append(('client', f"{COST_KEY_PREFIX}client:{client}"))
+    keys.append(('host', f"{COST_KEY_PREFIX}host:{urlparse(url).netloc.lower()}"))
+    return keys
+
+def record_job(task_id, record):
+    """
+    Grava o registro de custo de uma tentativa de extração.
+    
+    Tentativas que chegaram a abrir a página também alimentam o histórico
+    de tempos por URL, cliente e host usado na admissão.
+    """
+    data = json.dumps(record)
+    with jobs_client.pipeline(transaction=False) as pipe:
+        pipe.set(f"{JOB_KEY_PREFIX}{task_id}", data, ex=JOB_RECORD_TTL)
+        pipe.lpush(JOB_HISTORY_KEY, data)
+        pipe.ltrim(JOB_HISTORY_KEY, 0, JOB_HISTORY_LIMIT - 1)
+        if 'navegando' in record['phases']:
+            for basis, key in _cost_keys(record['url'], record.get('client')):
+                if basis == 'host':
+                    # O host guarda o cliente junto para a admissão contar cada um uma vez
+                    pipe.lpush(key, json.dumps({'client': record.get('client'), 'wall_time': record['wall_time']}))
+                else:
+                    pipe.lpush(key, record['wall_time'])
+                pipe.ltrim(key, 0, COST_HISTORY_SIZE - 1)
+                pipe.expire(key, COST_HISTORY_TTL[basis])
+        pipe.execute()
+
+def get_job_record(task_id):
+    """Registro de custo da última tentativa de um job (None se inexistente)"""
+    data = jobs_client.get(f"{JOB_KEY_PREFIX}{task_id}")
+    return json.loads(data) if data else None
+
+def _host_samples(values, client=None):
+    """
+    Mediana dos tempos de cada cliente no histórico do host, ignorando o
+    próprio cliente. Assim um único cliente (ou quem pede a extração) não
+    consegue sozinho deslocar a previsão do host para todos os outros.
+    """
+    by_client = {}
+    for value in values:
+        entry = json.loads(value)
+        if not isinstance(entry, dict) or not entry.get('client') or entry['client'] == client:
+            continue
+        by_client.setdefault(entry['client'], []).append(float(entry['wall_time']))
+    return [statistics.median(times) for times in by_client.values()]
+
+def predict_cost(url, client=None):
+    """
+    Prevê o tempo de execução (segundos) de uma extração pela mediana dos
+    tempos recentes da mesma URL, do mesmo cliente ou do mesmo host, usando
+    a dimensão mais específica com amostras suficientes.
+    
+    Returns:
+        dict: {'basis': ..., 'samples': ..., 'predicted_seconds': ...} ou None sem histórico
+    """
+    keys = _cost_keys(url, client)
+    with jobs_client.pipeline(transaction=False) as pipe:
+        for _, key in keys:
+            pipe.lrange(key, 0, -1)
+        histories = pipe.execute()
+    
+    for (basis, _), values in zip(keys, histories):
+        if basis == 'host':
+            samples = _host_samples(values, client)
+        else:
+            samples = [float(value) for value in values]
+        if len(samples) >= ADMISSION_MIN_SAMPLES[basis]:
+            return {
+                'basis': basis,
+                'samples': len(samples),
+                'predicted_seconds': round(statistics.median(samples), 1),
+            }
+    return None
+
+def check_admission(url, client=None):
+    """
+    Decide se uma extração deve ser iniciada, com base no custo previsto.
+    
+    Returns:
+        tuple: (decisão, previsão). A decisão é 'admit'; 'reject' quando a
+        própria URL costuma estourar o soft time limit; ou 'defer' quando o
+        risco vem do histórico do cliente ou do host (ex: plataforma lenta).
+    """
+    if not ADMISSION_ENABLED:
+        return 'admit', None
+    
+    prediction = predict_cost(url, client)
+    limit = celery_app.conf.task_soft_time_limit * ADMISSION_MAX_RATIO
+    if not prediction or prediction['predicted_seconds'] < limit:
+        return 'admit', prediction
+    if prediction['basis'] == 'url':
+        return 'reject', prediction
+    return 'defer', prediction
+
+def soft_time_limit_guard(seconds):
+    """
+    Impõe o soft time limit quando o worker roda com o pool gevent, que só
+    aplica o hard limit (via gevent.Timeout) e ignora o soft. Levanta
+    SoftTimeLimitExceeded após `seconds`; nos demais pools o Celery já faz isso.
+    """
+    if gevent is not None and gevent_monkey.is_module_patched('socket'):
+        return gevent.Timeout(max(seconds, 0), SoftTimeLimitExceeded(f"Soft time limit ({seconds:.0f}s) excedido"))
+    return contextlib.nullcontext()
+
 @celery_app.task(bind=True, max_retries=2)
-def run_extraction_task(self, url: str):
+def run_extraction_task(self, url: str, client: str = None):
     """
     Tarefa Celery que executa a extração de conversa.
-    Retorna o conteúdo Markdown em caso de sucesso ou uma mensagem de erro.
+    O conteúdo Markdown é gravado à parte, turno a turno, à medida que é
+    coletado (append_markdown); o resultado da tarefa é apenas um registro
+    pequeno de status.
+    
+    Cada tentativa grava um registro de custo (record_job): tempo por fase,
+    CPU e pico de RAM do navegador, bytes transferidos e número de turnos.
     
     Args:
         url: URL da conversa a ser extraída
+        client: Identificador do cliente (IP) que pediu a extração
         
     Returns:
-        str: Conteúdo da conversa em Markdown
+        dict: {'chars': ..., 'bytes': ...} do Markdown gravado
         
     Raises:
         Exception: Se a extração falhar
     """
+    started_at = time.time()
+    started = time.monotonic()
+    stats = {}
+    phases = {}
+    current = {'phase': 'iniciando', 'since': started}
+    status = 'error'
+    
+    def close_phase(now):
+        phases[current['phase']] = round(phases.get(current['phase'], 0) + now - current['since'], 2)
+    
     try:
         logger.info(f"[CELERY TASK {self.request.id}] Iniciando extração para: {url}")
         
-        result = extract_conversation(url)
+        def report_progress(phase, turns):
+            now = time.monotonic()
+            if phase != current['phase']:
+                close_phase(now)
+                current.update(phase=phase, since=now)
+            self.update_state(state='PROGRESS', meta={'phase': phase, 'turns': turns})
+        
+        def write_chunk(text):
+            append_markdown(self.request.id, text)
+        
+        # Cada tentativa recomeça o arquivo do zero
+        reset_markdown(self.request.id)
+        remaining = celery_app.conf.task_soft_time_limit - (time.monotonic() - started)
+        with soft_time_limit_guard(remaining):
+            result = extract_conversation(url, on_progress=report_progress, on_chunk=write_chunk, stats=stats)
         
         # Se a extração retornar uma tupla de erro, a tratamos
         if isinstance(result, tuple):
@@ -60,13 +430,53 @@ def run_extraction_task(self, url: str):
         if len(result) < 50:  # Muito curto para ser uma conversa real
             raise Exception("Conversa extraída está muito curta. Verifique a URL.")
         
+        size = len(result.encode('utf-8'))
+        if markdown_size(self.request.id) != size:
+            # Garante que o arquivo gravado corresponde ao resultado final
+            store_markdown(self.request.id, result)
         logger.info(f"[CELERY TASK {self.request.id}] Extração concluída com sucesso. Tamanho: {len(result)} caracteres")
-        return result
+        status = 'success'
+        return {'chars': len(result), 'bytes': size}
         
     except Exception as e:
         logger.error(f"[CELERY TASK {self.request.id}] Erro fatal: {str(e)}")
-        # Tentar novamente em caso de erro transitório
-        if self.request.retries < self.max_retries:
+        # Descarta o arquivo parcial
+        reset_markdown(self.request.id)
+        # O extractor captura exceções, então o estouro também é detectado pelo tempo
+        if (isinstance(e, SoftTimeLimitExceeded) or
+                time.monotonic() - started >= celery_app.conf.task_soft_time_limit):
+            status = 'timeout'
+        # Tentar novamente em caso de erro transitório (estouro de tempo não é transitório)
+        if status != 'timeout' and self.request.retries < self.max_retries:
             logger.info(f"[CELERY TASK {self.request.id}] Tentando novamente... (tentativa {self.request.retries + 1}/{self.max_retries})")
             raise self.retry(exc=e, countdown=30)  # Espera 30s antes de tentar novamente
-        raise
\ No newline at end of file
+        raise
+    
+    except BaseException:
+        # Hard time limit (gevent.Timeout) ou encerramento do worker: descarta o
+        # arquivo parcial e deixa a interrupção seguir
+        reset_markdown(self.request.id)
+        raise
+    
+    finally:
+        now = time.monotonic()
+        close_phase(now)
+        if status != 'success' and now - started >= celery_app.conf.task_soft_time_limit:
+            status = 'timeout'
+        record = {
+            'task_id': self.request.id,
+            'url': url,
+            'host': urlparse(url).netloc.lower(),
+            'client': client,
+            'attempt': self.request.retries + 1,
+            'status': status,
+            'started_at': started_at,
+            'wall_time': round(now - started, 2),
+            'phases': phases,
+            **stats,
+        }
+        try:
+            record_job(self.request.id, record)
+            logger.info(f"[CELERY TASK {self.request.id}] Custo: {record['wall_time']}s, {stats.get('turns', 0)} turnos, status {status}")
+        except Exception as e:
+            logger.warning(f"[CELERY TASK {self.request.id}] Falha ao gravar métricas: {str(e)}")
\ No newline at end of file
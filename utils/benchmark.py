@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Growchats - Benchmark de Throughput
+Mede requisições/segundo no endpoint /api/status de um ou mais servidores
+
+Uso:
+    # Desative o rate limiting no servidor medido (RATELIMIT_ENABLED=false)
+    python utils/benchmark.py http://127.0.0.1:5000 http://127.0.0.1:8000
+    python utils/benchmark.py http://127.0.0.1:5000 --concurrency 20 --duration 15
+
+Sem dependências externas (apenas biblioteca padrão).
+"""
+import argparse
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+def worker(url, deadline, stats, lock):
+    """Dispara requisições sequenciais até o prazo e acumula os resultados"""
+    ok = errors = 0
+    latencies = []
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=10) as resp:
+                resp.read()
+                ok += 1
+        except urllib.error.HTTPError as e:
+            # 429 indica rate limiting ativo: conta como erro
+            errors += 1
+            if e.code == 429:
+                stats['rate_limited'] = True
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    with lock:
+        stats['ok'] += ok
+        stats['errors'] += errors
+        stats['latencies'].extend(latencies)
+
+def run_benchmark(base_url, concurrency, duration):
+    """Executa o benchmark contra um servidor e retorna as métricas"""
+    # task_id aleatório: o status fica PENDING, exercitando a leitura no Redis
+    url = f"{base_url.rstrip('/')}/api/status/{uuid.uuid4()}"
+    stats = {'ok': 0, 'errors': 0, 'latencies': [], 'rate_limited': False}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    
+    threads = [
+        threading.Thread(target=worker, args=(url, deadline, stats, lock))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    
+    latencies = sorted(stats['latencies'])
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+    return {
+        'url': base_url,
+        'rps': stats['ok'] / elapsed if elapsed else 0,
+        'ok': stats['ok'],
+        'errors': stats['errors'],
+        'p50_ms': p50 * 1000,
+        'p95_ms': p95 * 1000,
+        'rate_limited': stats['rate_limited'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de /api/status do Growchats")
+    parser.add_argument('urls', nargs='+', help="URLs base dos servidores (ex: http://127.0.0.1:5000)")
+    parser.add_argument('--concurrency', type=int, default=10, help="Clientes simultâneos (padrão: 10)")
+    parser.add_argument('--duration', type=float, default=10, help="Duração por servidor em segundos (padrão: 10)")
+    args = parser.parse_args()
+    
+    print("📈 Growchats - Benchmark de /api/status")
+    print("=" * 60)
+    print(f"Concorrência: {args.concurrency} | Duração: {args.duration}s por servidor\n")
+    
+    results = []
+    for base_url in args.urls:
+        print(f"⏱️  Medindo {base_url}...")
+        results.append(run_benchmark(base_url, args.concurrency, args.duration))
+    
+    print("\n" + "=" * 60)
+    print(f"  {'Servidor':30} {'req/s':>8} {'p50':>8} {'p95':>8} {'erros':>6}")
+    for r in results:
+        print(f"  {r['url']:30} {r['rps']:>8.1f} {r['p50_ms']:>6.1f}ms {r['p95_ms']:>6.1f}ms {r['errors']:>6}")
+    
+    if any(r['rate_limited'] for r in results):
+        print("\n⚠️  Respostas 429 detectadas: inicie o servidor com RATELIMIT_ENABLED=false")
+    
+    if len(results) > 1 and results[0]['rps']:
+        print(f"\n  Ganho ({results[-1]['url']} vs {results[0]['url']}): "
+              f"{results[-1]['rps'] / results[0]['rps']:.1f}x")
+    print("=" * 60)
+    
+    if all(r['ok'] == 0 for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
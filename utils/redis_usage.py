@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Growchats - Uso de Memória do Redis
+Mostra quanto cada tipo de dado (fila, resultados, Markdown, rate limiting)
+ocupa no Redis, para dimensionar o maxmemory a partir de dados reais
+
+Uso:
+    python utils/redis_usage.py
+
+Usa as mesmas URLs da aplicação (REDIS_URL, CELERY_BROKER_URL,
+CELERY_RESULT_BACKEND, RATELIMIT_STORAGE_URL e JOBS_STORAGE_URL do ambiente).
+"""
+import os
+import sys
+
+import redis
+from limits.storage import RedisStorage
+
+# Permite importar os módulos da raiz do projeto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tasks import (
+    BROKER_URL, RESULT_BACKEND_URL, RATELIMIT_STORAGE_URL, JOBS_STORAGE_URL,
+    MARKDOWN_KEY_PREFIX, JOB_KEY_PREFIX, JOB_HISTORY_KEY, COST_KEY_PREFIX
+)
+
+# Categorias por prefixo de chave
+CATEGORIES = [
+    ('celery-task-meta-', 'Status das tarefas'),
+    (MARKDOWN_KEY_PREFIX, 'Arquivos Markdown'),
+    # O limits prefixa toda chave do Flask-Limiter (LIMITS:LIMITER/...)
+    (f"{RedisStorage.PREFIX}:", 'Contadores de rate limit'),
+    (JOB_KEY_PREFIX, 'Registros de custo por job'),
+    (JOB_HISTORY_KEY, 'Histórico de jobs'),
+    (COST_KEY_PREFIX, 'Histórico de custo (admissão)'),
+    ('_kombu.binding.', 'Bindings do broker'),
+    ('unacked', 'Tarefas em execução (unacked)'),
+]
+
+def format_bytes(bytes_value):
+    """Formata bytes para MB"""
+    return f"{bytes_value / (1024 * 1024):.2f} MB"
+
+def categorize(key):
+    """Classifica uma chave pelo prefixo"""
+    for prefix, label in CATEGORIES:
+        if key.startswith(prefix):
+            return label
+    return 'Fila de tarefas' if key == 'celery' else 'Outros'
+
+def scan_usage(client):
+    """Soma MEMORY USAGE de todas as chaves do banco, agrupando por categoria"""
+    usage = {}
+    for key in client.scan_iter(count=500):
+        label = categorize(key.decode('utf-8', 'replace'))
+        size = client.memory_usage(key) or 0
+        count, total = usage.get(label, (0, 0))
+        usage[label] = (count + 1, total + size)
+    return usage
+
+def main():
+    roles = [
+        ('Fila (broker)', BROKER_URL),
+        ('Resultados', RESULT_BACKEND_URL),
+        ('Rate limiting', RATELIMIT_STORAGE_URL),
+        ('Contabilidade de jobs', JOBS_STORAGE_URL),
+    ]
+    
+    print("🧮 Growchats - Uso de Memória do Redis")
+    print("=" * 60)
+    
+    totals = {}
+    seen_urls = set()
+    for role, url in roles:
+        if url in seen_urls:
+            print(f"\n📦 {role}: mesmo banco já listado acima")
+            continue
+        seen_urls.add(url)
+        
+        try:
+            client = redis.Redis.from_url(url)
+            usage = scan_usage(client)
+        except redis.RedisError as e:
+            print(f"\n❌ {role}: não foi possível ler o banco ({e})")
+            continue
+        
+        role_total = sum(total for _, total in usage.values())
+        totals[role] = role_total
+        print(f"\n📦 {role} ({url.rsplit('@', 1)[-1]}): {format_bytes(role_total)}")
+        for label, (count, total) in sorted(usage.items(), key=lambda item: -item[1][1]):
+            print(f"  {label:32} {count:>7} chaves | {format_bytes(total):>10}")
+    
+    if not totals:
+        sys.exit(1)
+    
+    brokerless = sum(total for role, total in totals.items() if role != 'Fila (broker)')
+    print("\n" + "=" * 60)
+    print(f"  Dados sem o broker (resultados + rate limiting + jobs): {format_bytes(brokerless)}")
+    print(f"  Dados totais (todas as chaves):                         {format_bytes(sum(totals.values()))}")
+    
+    # Visão da instância (memória real, inclui overhead e fragmentação)
+    hosts = {}
+    for _, url in roles:
+        hosts.setdefault(url.rsplit('/', 1)[0], url)
+    for url in hosts.values():
+        try:
+            client = redis.Redis.from_url(url)
+            memory = client.info('memory')
+            stats = client.info('stats')
+        except redis.RedisError:
+            continue
+        maxmemory = memory.get('maxmemory', 0)
+        print(f"\n💻 INSTÂNCIA {url.rsplit('@', 1)[-1].rsplit('/', 1)[0]}:")
+        print(f"  Memória usada: {format_bytes(memory['used_memory'])} (pico: {format_bytes(memory['used_memory_peak'])})")
+        print(f"  maxmemory: {format_bytes(maxmemory) if maxmemory else 'sem limite'} | política: {memory.get('maxmemory_policy')}")
+        print(f"  Chaves removidas por falta de memória (evicted_keys): {stats.get('evicted_keys', 0)}")
+        if stats.get('evicted_keys'):
+            print("  ⚠️  Houve evicção: aumente o maxmemory ou reduza RESULT_EXPIRES")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
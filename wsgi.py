@@ -0,0 +1,6 @@
+# wsgi.py - Ponto de entrada WSGI para servidores de produção (Gunicorn)
+from app import app
+
+# Uso:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+application = app